@@ -0,0 +1,107 @@
+"""
+Persistent diagnostics cache.
+
+Entries are keyed by the hash of the validated document content and the hash
+of the schema(s) it was validated against, so a cached result is valid for
+as long as neither changes, across restarts.
+"""
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+MAX_ENTRIES = 5000
+
+
+def content_hash(data):
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    return hashlib.sha1(data).hexdigest()
+
+
+def schema_content_hash(schema):
+    return content_hash(json.dumps(schema, sort_keys=True, separators=(',', ':')))
+
+
+class DiagnosticsCache(object):
+    def __init__(self, path, max_entries=MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = None  # (text hash, schema hash) -> diagnostics
+        self._files = None  # file name -> (text hash, schema hash)
+        self._schemas = None  # schema url -> last seen content hash
+        self._dirty = False
+
+    def _load(self):
+        if self._entries is not None:
+            return
+        self._entries = OrderedDict()
+        self._files = {}
+        self._schemas = {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as fp:
+                data = json.load(fp)
+        except (IOError, ValueError):
+            return
+        for key, diagnostics in data.get("entries", ()):
+            self._entries[tuple(key)] = diagnostics
+        for file_name, key in data.get("files", {}).items():
+            self._files[file_name] = tuple(key)
+        self._schemas.update(data.get("schemas", {}))
+
+    def schema_hash(self, url, schema=None):
+        """Returns the content hash of the schema at `url`, remembering it when
+        `schema` is given, or the last one seen otherwise."""
+        with self._lock:
+            self._load()
+            if schema is not None:
+                digest = schema_content_hash(schema)
+                if self._schemas.get(url) != digest:
+                    self._schemas[url] = digest
+                    self._dirty = True
+            return self._schemas.get(url)
+
+    def get(self, text_hash, schema_hash):
+        with self._lock:
+            self._load()
+            return self._entries.get((text_hash, schema_hash))
+
+    def put(self, file_name, text_hash, schema_hash, diagnostics):
+        key = (text_hash, schema_hash)
+        with self._lock:
+            self._load()
+            self._entries.pop(key, None)
+            self._entries[key] = diagnostics
+            self._files[file_name] = key
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._dirty = True
+
+    def problems(self):
+        """Returns {file name: diagnostics} for the latest validation of each file."""
+        with self._lock:
+            self._load()
+            result = {}
+            for file_name, key in self._files.items():
+                diagnostics = self._entries.get(key)
+                if diagnostics:
+                    result[file_name] = diagnostics
+            return result
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            data = {
+                "entries": [[list(key), diagnostics] for key, diagnostics in self._entries.items()],
+                "files": dict((f, list(k)) for f, k in self._files.items() if k in self._entries),
+                "schemas": self._schemas,
+            }
+            self._dirty = False
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as fp:
+            json.dump(data, fp, separators=(',', ':'))
+        os.replace(tmp, self.path)
@@ -0,0 +1,153 @@
+"""
+Whitespace-only formatter for JSON and JSON with comments.
+
+The document is never rebuilt: tokens are scanned lazily and, for every gap
+between two tokens whose whitespace differs from the canonical layout, a
+`(begin, end, text)` edit is yielded. Applying the edits from last to first
+produces the formatted document; coalesce() merges them into a few large
+ones, for editors where each edit has a fixed cost.
+"""
+import re
+
+TOKEN_RE = re.compile(r'''
+    (?P<value>"(?:[^"\\\n]|\\.)*"?)      # string, possibly unterminated
+  | (?P<line>//[^\n]*)                  # line comment
+  | (?P<block>/\*(?:.|\n)*?(?:\*/|\Z))   # block comment, possibly unterminated
+  | (?P<punct>[{}\[\],:])               # punctuation
+  | (?P<other>[^\s{}\[\],:"/]+|/)       # numbers, literals and anything else
+''', re.VERBOSE)
+
+OPEN = '{['
+CLOSE = '}]'
+
+COALESCE_SPAN = 64 * 1024
+
+
+def tokens(text, start=0):
+    """Yields `(kind, begin, end)` from `start` on; kind is the punctuation
+    character, 'line' or 'block' for comments and 'value' for everything else."""
+    for match in TOKEN_RE.finditer(text, start):
+        kind = match.lastgroup
+        if kind == 'punct':
+            kind = match.group()
+        elif kind == 'other':
+            kind = 'value'
+        yield kind, match.start(), match.end()
+
+
+def enclosing_container(text, begin, end):
+    """Returns the span of the innermost object or array covering
+    `[begin, end)`, or None if the selection is not inside one."""
+    stack = []
+    for kind, token_begin, token_end in tokens(text):
+        if kind in OPEN:
+            stack.append(token_begin)
+        elif kind in CLOSE and stack:
+            open_begin = stack.pop()
+            # Inner containers close first, so the first hit is the innermost.
+            if open_begin <= begin and token_end >= end:
+                return open_begin, token_end
+    return None
+
+
+def line_indent(text, point):
+    line_begin = text.rfind('\n', 0, point) + 1
+    line_end = line_begin
+    while line_end < point and text[line_end] in ' \t':
+        line_end += 1
+    return text[line_begin:line_end]
+
+
+def separator(prev, kind, gap, indent):
+    newline = '\n' + indent
+    if kind in ('line', 'block'):
+        if prev is None or prev == 'line' or '\n' in gap:
+            return newline
+        return ' '
+    if prev == 'line':
+        return newline
+    if prev == 'block':
+        # A trailing comment stays on its line, the closing bracket doesn't.
+        return newline if '\n' in gap or kind in CLOSE else ' '
+    if kind in CLOSE:
+        return '' if prev in OPEN else newline
+    if prev in OPEN or prev == ',':
+        return newline
+    if prev == ':':
+        return ' '
+    if kind in ',:':
+        return ''
+    return gap
+
+
+def format_edits(text, region=None, tab_size=4, insert_spaces=True):
+    """Yields the minimal edits that format `text`.
+
+    If `region` (a `(begin, end)` tuple) is given, only the innermost object
+    or array enclosing it is formatted, indented relative to the line it
+    starts on.
+    """
+    unit = ' ' * tab_size if insert_spaces else '\t'
+    base = ''
+    span_begin, span_end = 0, len(text)
+    if region is not None:
+        container = enclosing_container(text, *region)
+        if container is not None:
+            span_begin, span_end = container
+            base = line_indent(text, span_begin)
+
+    depth = 0
+    level_offset = None
+    prev = None
+    prev_end = 0
+    for kind, begin, end in tokens(text):
+        if kind in CLOSE:
+            depth = max(depth - 1, 0)
+        if begin >= span_begin and end <= span_end:
+            if level_offset is None:
+                level_offset = depth
+                if region is None and begin > 0:
+                    # Leading whitespace before the first token.
+                    yield 0, begin, ''
+            else:
+                gap = text[prev_end:begin]
+                wanted = separator(prev, kind, gap, base + unit * (depth - level_offset))
+                if wanted != gap:
+                    yield prev_end, begin, wanted
+        elif end > span_end:
+            break
+        if kind in OPEN:
+            depth += 1
+        prev = kind
+        prev_end = end
+
+
+def coalesce(text, edits, span=COALESCE_SPAN):
+    """Merges consecutive `edits` of `text` (as yielded by format_edits())
+    into single edits covering up to about `span` characters each."""
+    begin = end = None
+    parts = []
+    for edit_begin, edit_end, replacement in edits:
+        if begin is not None and edit_end - begin > span:
+            yield begin, end, ''.join(parts)
+            begin = None
+        if begin is None:
+            begin, parts = edit_begin, []
+        else:
+            parts.append(text[end:edit_begin])
+        parts.append(replacement)
+        end = edit_end
+    if begin is not None:
+        yield begin, end, ''.join(parts)
+
+
+def format_text(text, **options):
+    """Returns `text` formatted; a convenience wrapper around format_edits()."""
+    chunks = []
+    last = 0
+    for begin, end, replacement in format_edits(text, **options):
+        chunks.append(text[last:begin])
+        chunks.append(replacement)
+        last = end
+    chunks.append(text[last:])
+    return ''.join(chunks)
@@ -0,0 +1,117 @@
+"""
+Memory reports for the plugin (tracemalloc) and the server (V8 statistics).
+
+The first plugin snapshot only starts tracing; every following one is
+diffed against the previous snapshot, so growth between two captures is
+attributed to the lines that allocated it. Tracing slows every allocation
+down and keeps a traceback per block alive, so the last capture should stop
+it (`stop=True`).
+"""
+import os
+import sys
+
+try:
+    import tracemalloc
+except ImportError:  # Python 3.3
+    tracemalloc = None
+
+TOP_ALLOCATORS = 25
+TRACEBACK_FRAMES = 10
+
+_previous_snapshot = None
+
+
+def deep_size(obj, seen=None):
+    """Approximate size in bytes of `obj` and everything it contains."""
+    seen = set() if seen is None else seen
+    size = 0
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+    return size
+
+
+def format_size(size):
+    for unit in ('B', 'KiB', 'MiB'):
+        if abs(size) < 1024:
+            return "{:.1f} {}".format(size, unit)
+        size /= 1024.0
+    return "{:.1f} GiB".format(size)
+
+
+def plugin_report(objects, stop=False):
+    """Returns a text report; `objects` maps a name to a plugin data structure
+    (catalog, caches...) whose size is included. With `stop`, tracing is
+    stopped once the diff is taken (or not started)."""
+    global _previous_snapshot
+    lines = ["# Plugin data structures"]
+    for name, obj in sorted(objects.items()):
+        lines.append("{:>12}  {}".format(format_size(deep_size(obj)), name))
+    lines.append("")
+
+    if tracemalloc is None:
+        lines.append("tracemalloc is not available in this Python ({}).".format(sys.version))
+        return "\n".join(lines)
+    if not tracemalloc.is_tracing():
+        if stop:
+            lines.append("tracemalloc is not running.")
+            return "\n".join(lines)
+        tracemalloc.start(TRACEBACK_FRAMES)
+        _previous_snapshot = tracemalloc.take_snapshot()
+        lines.append("tracemalloc started; capture again to get a diff.")
+        return "\n".join(lines)
+
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ))
+    current, peak = tracemalloc.get_traced_memory()
+    lines.append("# Traced memory: {} (peak {})".format(format_size(current), format_size(peak)))
+    lines.append("")
+    lines.append("# Top {} allocators since the previous capture".format(TOP_ALLOCATORS))
+    for stat in snapshot.compare_to(_previous_snapshot, 'lineno')[:TOP_ALLOCATORS]:
+        frame = stat.traceback[0]
+        lines.append("{:>12}  {:>12}  {}:{}".format(
+            format_size(stat.size),
+            ('+' if stat.size_diff >= 0 else '-') + format_size(abs(stat.size_diff)),
+            os.path.basename(frame.filename), frame.lineno))
+    _previous_snapshot = snapshot
+    if stop:
+        tracemalloc.stop()
+        _previous_snapshot = None
+        lines.append("")
+        lines.append("tracemalloc stopped.")
+    return "\n".join(lines)
+
+
+def server_report(result):
+    """Returns a text report from the server's json/memoryUsage response."""
+    lines = ["# Server process"]
+    for name, size in sorted(result["memoryUsage"].items()):
+        lines.append("{:>12}  {}".format(format_size(size), name))
+    lines.append("{:>12}  open documents".format(result.get("documents", 0)))
+    lines.append("")
+    lines.append("# V8 heap spaces")
+    spaces = sorted(result.get("heapSpaces", ()), key=lambda space: -space["space_used_size"])
+    for space in spaces:
+        lines.append("{:>12}  {}".format(format_size(space["space_used_size"]), space["space_name"]))
+    if result.get("heapSnapshot"):
+        lines.append("")
+        lines.append("Heap snapshot: {}".format(result["heapSnapshot"]))
+    if result.get("shards"):
+        lines.append("")
+        lines.append("# Server instances")
+        for name, usage in sorted(result["shards"].items()):
+            lines.append("{:>12}  {}".format(format_size(usage["rss"]), name))
+            if usage.get("heapSnapshot"):
+                lines.append("{:>12}  heap snapshot: {}".format("", usage["heapSnapshot"]))
+    return "\n".join(lines)
@@ -1,15 +1,112 @@
 import sublime
+import sublime_plugin
 
 import os
+import html
+import json
+import time
 import shutil
+import queue
+import fnmatch
+import threading
+import traceback
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from SublimeCodeIntel.plugin.core.settings import ClientConfig
 from SublimeCodeIntel.plugin.core.handlers import LanguageHandler
+from SublimeCodeIntel.plugin.core.protocol import Request, Notification
+from SublimeCodeIntel.plugin.core.documents import get_document_position, purge_did_change
 from SublimeCodeIntel.plugin.core.spinner import spinner
 
+from .formatting import coalesce, format_edits
+from .diagnostics import DiagnosticsCache, content_hash
+from .sniffing import SNIFF_SIZE, sniff_schema
+from .memory import plugin_report, server_report
+from .schema_index import SchemaIndex, PathCache
+
 package_path = os.path.dirname(__file__)
 server_path = os.path.join(package_path, 'server')
 
+# Seconds without client traffic before server/router.js shuts down its
+# server instances (the router itself keeps running and restarts them on the
+# next document message, so the client never sees it). Instances only start
+# once a document is opened, and a router left without documents for half an
+# hour exits.
+IDLE_TIMEOUT = 10 * 60
+
+# window id -> timestamp of the last JSON activity seen in that window
+_last_activity = {}
+# window id -> running client
+_clients = {}
+
+# Concurrent connections used to prefetch schemas for already open files.
+SCHEMA_FETCH_WORKERS = 4
+SCHEMA_FETCH_TIMEOUT = 10
+
+# schema url -> parsed schema; written from background threads, so only
+# iterate over cached_schemas().
+_schema_cache = {}
+_schema_cache_lock = threading.Lock()
+# window id -> settings last pushed to that window's server
+_pushed_settings = {}
+
+# Background validation of workspace files: seconds the user must have been
+# idle before the next file is validated, pause between two files, and how
+# long to wait for the server's diagnostics.
+BACKGROUND_IDLE = 5
+BACKGROUND_DELAY = 0.5
+BACKGROUND_TIMEOUT = 10
+BACKGROUND_SKIP_DIRS = {'.git', '.hg', '.svn', 'node_modules', '__pycache__'}
+CACHED_DIAGNOSTICS_KEY = 'code_intel_json_cached'
+# Diagnostics arriving sooner than this after an edit may be for an older
+# version of the document (didChange and validation are both debounced by
+# about half a second) and are not cached.
+DIAGNOSTICS_SETTLE = 1.0
+
+# view id -> timestamp of its last modification
+_last_modified = {}
+
+# window id -> {document uri: [schema urls]} found by content sniffing
+_sniffed_associations = {}
+
+# Documents up to this size get completions and hovers from the precompiled
+# schema tables on the UI thread; bigger ones are left to the server.
+LOCAL_ENGINE_MAX_SIZE = 256 * 1024
+# Features the plugin answers itself; the server does not advertise them, so
+# the framework never requests them, and is only asked by the plugin when the
+# tables cannot answer.
+LOCAL_FEATURES = ["completion", "hover"]
+# The server's completion trigger characters, which the framework would have
+# registered had the server advertised completions.
+COMPLETION_TRIGGERS = '":'
+
+# schema url -> SchemaIndex
+_schema_indexes = {}
+# view id -> PathCache
+_path_caches = {}
+# view id -> ((change count, point), completions) answered by the server
+_server_completions = {}
+
+# Server features per language (the keys of CodeIntelJsonClientConfig.languages);
+# a feature set to False is neither computed nor published for that language.
+# Features: validate, completion, hover, symbols, colors, folding.
+CAPABILITY_PROFILES = {
+    # Sublime's own files: no color decorations, folding or symbols; keep
+    # syntax validation.
+    "jsonc": {
+        "colors": False,
+        "folding": False,
+        "symbols": False,
+    },
+}
+
+# uri -> callback waiting for the diagnostics of a background validation
+_pending_validations = {}
+_diagnostics_cache = None
+_save_scheduled = False
+
 
 def node_command():
     return "node"
@@ -19,12 +116,480 @@ def node_is_installed():
     return shutil.which(node_command()) is not None
 
 
+def config_scopes(config):
+    return [scope for language in config.languages.values() for scope in language["scopes"]]
+
+
+def view_matches(view, config):
+    if not view or not view.is_valid():
+        return False
+    return any(view.score_selector(0, scope) > 0 for scope in config_scopes(config))
+
+
+def run_in_thread(target, name):
+    """Runs `target` on its own daemon thread, so slow work never holds up
+    Sublime's shared async worker (or the UI thread)."""
+    thread = threading.Thread(target=target, name="JSON-CodeIntel " + name)
+    thread.daemon = True
+    thread.start()
+
+
+_background_jobs = queue.Queue()
+_background_worker = None
+
+
+def run_in_background(target):
+    """Queues `target` on the single background worker, where jobs sharing
+    the schema cache run one at a time and in order (messages they queue on
+    the async worker keep that order too)."""
+    global _background_worker
+    if _background_worker is None:
+        def work():
+            while True:
+                job = _background_jobs.get()
+                try:
+                    job()
+                except Exception:
+                    traceback.print_exc()
+        _background_worker = threading.Thread(target=work, name="JSON-CodeIntel background")
+        _background_worker.daemon = True
+        _background_worker.start()
+    _background_jobs.put(target)
+
+
+def touch(window):
+    if window:
+        _last_activity[window.id()] = time.time()
+
+
+def file_matches(file_name, pattern):
+    # Same semantics as the server: patterns are matched against the end of
+    # the path, and '*' may span directories.
+    return fnmatch.fnmatchcase(file_name.replace(os.sep, '/'), '*' + pattern)
+
+
+def schema_urls_for(file_name, schemas):
+    urls = []
+    for schema in schemas:
+        url = schema.get("url")
+        if url and any(file_matches(file_name, pattern) for pattern in schema.get("fileMatch", ())):
+            urls.append(url)
+    return urls
+
+
+def schema_refs(schema, base_url):
+    """Returns the absolute urls of external documents referenced by `$ref`."""
+    refs = set()
+    stack = [schema]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, dict):
+            ref = node.get("$ref")
+            if isinstance(ref, str) and not ref.startswith('#'):
+                url = urllib.parse.urldefrag(urllib.parse.urljoin(base_url, ref))[0]
+                if url.startswith(("http://", "https://")):
+                    refs.add(url)
+            stack.extend(node.values())
+        elif isinstance(node, list):
+            stack.extend(node)
+    return refs
+
+
+def fetch_schema(url):
+    request = urllib.request.Request(url, headers={"Accept": "application/json"})
+    with urllib.request.urlopen(request, timeout=SCHEMA_FETCH_TIMEOUT) as response:
+        return json.loads(response.read().decode('utf-8'))
+
+
+def prefetch_schemas(urls, workers=SCHEMA_FETCH_WORKERS):
+    """Fetches `urls` and every schema they transitively `$ref` into the cache."""
+    pending = set(url for url in urls if url not in _schema_cache)
+    seen = set(pending)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while pending:
+            futures = {executor.submit(fetch_schema, url): url for url in pending}
+            pending = set()
+            for future in as_completed(futures):
+                url = futures[future]
+                try:
+                    schema = future.result()
+                except Exception as e:
+                    print("JSON-CodeIntel: cannot fetch schema {}: {}".format(url, e))
+                    continue
+                with _schema_cache_lock:
+                    _schema_cache[url] = schema
+                for ref in schema_refs(schema, url):
+                    if ref not in seen and ref not in _schema_cache:
+                        seen.add(ref)
+                        pending.add(ref)
+
+
+def cached_schemas():
+    """Returns a snapshot of the schema cache."""
+    with _schema_cache_lock:
+        return dict(_schema_cache)
+
+
+def filename_to_uri(file_name):
+    return urllib.parse.urljoin('file:', urllib.request.pathname2url(file_name))
+
+
+def uri_to_filename(uri):
+    return urllib.request.url2pathname(urllib.parse.urlparse(uri).path)
+
+
+def diagnostics_cache():
+    global _diagnostics_cache
+    if _diagnostics_cache is None:
+        _diagnostics_cache = DiagnosticsCache(
+            os.path.join(sublime.cache_path(), 'JSON-CodeIntel', 'diagnostics.json'))
+    return _diagnostics_cache
+
+
+def schedule_cache_save():
+    global _save_scheduled
+    if _save_scheduled:
+        return
+    _save_scheduled = True
+
+    def save():
+        global _save_scheduled
+        _save_scheduled = False
+        diagnostics_cache().save()
+    sublime.set_timeout_async(save, 5000)
+
+
+def schemas_hash(urls):
+    """Combined content hash of the schemas at `urls`, None if one is unknown."""
+    if not urls:
+        return None
+    cache = diagnostics_cache()
+    digests = []
+    for url in sorted(urls):
+        digest = cache.schema_hash(url, _schema_cache.get(url))
+        if digest is None:
+            return None
+        digests.append(digest)
+    return content_hash('\n'.join(digests))
+
+
+def workspace_files(folders, schemas):
+    """Yields `(file name, schema urls)` for every file under `folders` with a schema."""
+    for folder in folders:
+        for root, dirs, files in os.walk(folder):
+            dirs[:] = [d for d in dirs if d not in BACKGROUND_SKIP_DIRS and not d.startswith('.')]
+            for name in files:
+                file_name = os.path.join(root, name)
+                urls = schema_urls_for(file_name, schemas)
+                if urls:
+                    yield file_name, urls
+
+
+def diagnostic_region(view, diagnostic):
+    start = diagnostic["range"]["start"]
+    end = diagnostic["range"]["end"]
+    return sublime.Region(
+        view.text_point(start["line"], start["character"]),
+        view.text_point(end["line"], end["character"]))
+
+
+def show_cached_diagnostics(view):
+    """Marks the cached diagnostics of `view` until the server publishes fresh ones."""
+    urls = schema_urls_for(view.file_name(), json_config().settings["json"]["schemas"])
+    schema_hash = schemas_hash(urls)
+    if schema_hash is None:
+        return
+    text = view.substr(sublime.Region(0, view.size()))
+    diagnostics = diagnostics_cache().get(content_hash(text), schema_hash)
+    if diagnostics:
+        view.add_regions(
+            CACHED_DIAGNOSTICS_KEY,
+            [diagnostic_region(view, diagnostic) for diagnostic in diagnostics],
+            'markup.warning', '',
+            sublime.DRAW_NO_FILL | sublime.DRAW_NO_OUTLINE | sublime.DRAW_SQUIGGLY_UNDERLINE)
+
+
+def sniff_view(view):
+    """Associates a schema to `view` by its content if no fileMatch applies.
+
+    Returns True if the window's associations changed.
+    """
+    window = view.window()
+    file_name = view.file_name()
+    if not window or not file_name:
+        return False
+    associations = _sniffed_associations.setdefault(window.id(), {})
+    uri = filename_to_uri(file_name)
+    url = None
+    if not schema_urls_for(file_name, json_config().settings["json"]["schemas"]):
+        head = view.substr(sublime.Region(0, min(view.size(), SNIFF_SIZE)))
+        url = sniff_schema(head.encode('utf-8'))
+    if url is None:
+        return associations.pop(uri, None) is not None
+    if associations.get(uri) == [url]:
+        return False
+    associations[uri] = [url]
+    return True
+
+
+def push_associations(window, client):
+    # The document uri is used as the pattern; the server matches patterns
+    # against the end of the uri, so it only applies to that document.
+    client.send_notification(Notification(
+        "json/schemaAssociations", _sniffed_associations.get(window.id(), {})))
+
+
+def view_schema_urls(view):
+    file_name = view.file_name()
+    if not file_name:
+        return []
+    urls = schema_urls_for(file_name, json_config().settings["json"]["schemas"])
+    if not urls and view.window():
+        urls = _sniffed_associations.get(view.window().id(), {}).get(filename_to_uri(file_name), [])
+    return urls
+
+
+def build_schema_indexes(urls):
+    """Precompiles the cached schemas at `urls`; call off the UI thread."""
+    for url in urls:
+        if url in _schema_cache and url not in _schema_indexes:
+            _schema_indexes[url] = SchemaIndex(_schema_cache[url])
+
+
+def view_schema_index(view):
+    """Returns the compiled schema for `view`, None if the server should answer."""
+    if view.size() > LOCAL_ENGINE_MAX_SIZE:
+        return None
+    urls = view_schema_urls(view)
+    # Several schemas for one document need the server to combine them.
+    if len(urls) != 1:
+        return None
+    return _schema_indexes.get(urls[0])
+
+
+def view_path_cache(view):
+    cache = _path_caches.get(view.id())
+    if cache is None:
+        cache = _path_caches[view.id()] = PathCache()
+    return cache
+
+
+def snippet_escape(text):
+    """Escapes plain `text` for completion contents, which Sublime treats as snippets."""
+    return text.replace("\\", "\\\\").replace("$", "\\$")
+
+
+def local_completions(view, prefix, point):
+    index = view_schema_index(view)
+    if index is None:
+        return None
+    text = view.substr(sublime.Region(0, point))
+    path, in_key = view_path_cache(view).json_path(text, point)
+    node = index.lookup(path)
+    if node is None or node.complex:
+        return None
+    in_string = view.substr(point - len(prefix) - 1) == '"'
+    completions = []
+    if in_key:
+        for name, description in sorted(node.properties.items()):
+            contents = name if in_string else '"{}": '.format(name)
+            completions.append(["{}\t{}".format(name, description[:40]), snippet_escape(contents)])
+    else:
+        values = list(node.enum or [])
+        if node.default is not None and node.default not in values:
+            values.append(node.default)
+        for value in values:
+            contents = json.dumps(value)
+            if in_string:
+                if not isinstance(value, str):
+                    continue
+                contents = contents[1:-1]
+            completions.append([
+                "{}\t{}".format(contents, "default" if value == node.default else "enum"),
+                snippet_escape(contents)])
+    return completions or None
+
+
+def local_hover(view, point):
+    """Returns the html describing the property or value at `point`, or None."""
+    index = view_schema_index(view)
+    if index is None:
+        return None
+    line_end = view.line(point).end()
+    text = view.substr(sublime.Region(0, line_end))
+    cache = view_path_cache(view)
+    token = None
+    for token in cache.tokens(text, point):
+        if token[1] <= point < token[2]:
+            break
+    else:
+        return None
+    kind, begin, end = token
+    path, in_key = cache.json_path(text, begin)
+    if in_key:
+        if kind != 'value' or text[begin] != '"':
+            return None
+        try:
+            path += (json.loads(text[begin:end]),)
+        except ValueError:
+            return None
+    node = index.lookup(path)
+    if node is None or node.complex or not node.description:
+        return None
+    content = "<p>{}</p>".format(html.escape(node.description))
+    if node.default is not None:
+        content += "<p>Default: <code>{}</code></p>".format(html.escape(json.dumps(node.default)))
+    return content
+
+
+def add_completion_triggers(view):
+    settings = view.settings()
+    triggers = settings.get("auto_complete_triggers") or []
+    trigger = {
+        "selector": ", ".join(config_scopes(json_config())),
+        "characters": COMPLETION_TRIGGERS,
+    }
+    if trigger not in triggers:
+        settings.set("auto_complete_triggers", triggers + [trigger])
+
+
+def view_client(view):
+    window = view.window()
+    return _clients.get(window.id()) if window else None
+
+
+def completion_item(item):
+    """Converts an LSP CompletionItem to a Sublime completion."""
+    contents = (item.get("textEdit") or {}).get("newText") or item.get("insertText") or item["label"]
+    if item.get("insertTextFormat") != 2:
+        contents = snippet_escape(contents)
+    return ["{}\t{}".format(item["label"], (item.get("detail") or "")[:40]), contents]
+
+
+def server_completions(view, point):
+    """Returns the server's completions at `point` if they already arrived;
+    otherwise requests them and reopens the completion popup when they do."""
+    key = (view.change_count(), point)
+    answered = _server_completions.pop(view.id(), None)
+    if answered and answered[0] == key:
+        return answered[1]
+    client = view_client(view)
+    if not client:
+        return None
+
+    def done(result):
+        items = result.get("items", ()) if isinstance(result, dict) else result or ()
+        _server_completions[view.id()] = (key, [completion_item(item) for item in items])
+
+        def reopen():
+            sel = view.sel()
+            if items and view.change_count() == key[0] and len(sel) and sel[0].b == point:
+                view.run_command("auto_complete", {
+                    "disable_auto_insert": True,
+                    "next_completion_if_showing": False,
+                })
+        sublime.set_timeout(reopen, 0)
+
+    purge_did_change(view.buffer_id())
+    client.send_request(Request("textDocument/completion", get_document_position(view, point)), done)
+    return None
+
+
+def hover_content(contents):
+    """Converts the contents of an LSP Hover to html."""
+    if not isinstance(contents, list):
+        contents = [contents]
+    parts = []
+    for content in contents:
+        if isinstance(content, dict):
+            value = html.escape(content.get("value", ""))
+            if "language" in content:
+                value = "<code>{}</code>".format(value)
+        else:
+            value = html.escape(content or "")
+        if value:
+            parts.append("<p>{}</p>".format(value.replace("\n", "<br>")))
+    return "".join(parts)
+
+
+def server_hover(view, point):
+    """Requests the server's hover at `point` and shows it when it arrives."""
+    client = view_client(view)
+    if not client:
+        return
+    change_count = view.change_count()
+
+    def done(result):
+        content = hover_content(result.get("contents")) if result else None
+        if content and view.change_count() == change_count:
+            sublime.set_timeout(lambda: view.show_popup(
+                content, sublime.HIDE_ON_MOUSE_MOVE_AWAY, location=point, max_width=600), 0)
+
+    purge_did_change(view.buffer_id())
+    client.send_request(Request("textDocument/hover", get_document_position(view, point)), done)
+
+
+def schema_entries(settings):
+    """Returns {url: [schema entries]} of `settings`."""
+    result = {}
+    for schema in settings.get("json", {}).get("schemas", ()):
+        result.setdefault(schema.get("url"), []).append(schema)
+    return result
+
+
+def without_schemas(settings):
+    return dict(settings, json=dict(settings.get("json", {}), schemas=None))
+
+
+def push_settings(window, client, settings):
+    """Brings the server's configuration up to `settings`.
+
+    When only schemas changed since the last push, just the entries of the
+    changed urls are sent (json/schemaDelta) rather than the whole settings
+    with every inlined schema; the server revalidates the documents those
+    entries match.
+    """
+    pushed = _pushed_settings.get(window.id())
+    _pushed_settings[window.id()] = settings
+    if pushed is None or without_schemas(pushed) != without_schemas(settings):
+        client.send_notification(Notification.didChangeConfiguration({"settings": settings}))
+        return
+    old, new = schema_entries(pushed), schema_entries(settings)
+    changed = [url for url in new if old.get(url) != new[url]]
+    removed = [url for url in old if url not in new]
+    if None in changed or None in removed:
+        # Entries without a url are identified by position on the server.
+        client.send_notification(Notification.didChangeConfiguration({"settings": settings}))
+    elif changed or removed:
+        client.send_notification(Notification("json/schemaDelta", {
+            "changed": [schema for url in changed for schema in new[url]],
+            "removed": removed,
+        }))
+
+
+def warm_settings(settings):
+    """Returns `settings` with every cached schema inlined so the server never fetches it."""
+    cache = cached_schemas()
+    schemas = []
+    known = set()
+    for schema in settings["json"]["schemas"]:
+        url = schema.get("url")
+        if url in cache:
+            schema = dict(schema, schema=cache[url])
+        known.add(url)
+        schemas.append(schema)
+    for url, content in cache.items():
+        if url not in known:
+            schemas.append({"url": url, "schema": content})
+    return dict(settings, json=dict(settings["json"], schemas=schemas))
+
+
 class CodeIntelJsonClientConfig(ClientConfig):
     def __init__(self):
         self.name = "json"
         self.binary_args = [
             node_command(),
-            os.path.join(server_path, "vscode-json-languageserver.js"),
+            os.path.join(server_path, "router.js"),
             "--stdio"
         ]
         self.tcp_port = None
@@ -39,7 +604,27 @@ class CodeIntelJsonClientConfig(ClientConfig):
             },
         }
         self.enabled = True
-        self.init_options = {}
+        self.init_options = {
+            "idleTimeout": IDLE_TIMEOUT,
+            # Path server/router.js records all LSP traffic to, for
+            # tools/lsp_replay.py.
+            "trace": None,
+            "profiles": CAPABILITY_PROFILES,
+            "localFeatures": LOCAL_FEATURES,
+            # Documents served by their own server instances, see server/router.js;
+            # everything else shares the default instance.
+            "shards": [
+                {
+                    "name": "cloudformation",
+                    "fileMatch": ["*.cf.json", "cloudformation.json", "*.sam.json", "sam.json"],
+                },
+                {
+                    "name": "large",
+                    "minSize": 1024 * 1024,
+                    "instances": 2,
+                },
+            ],
+        }
         self.settings = {
             # From http://schemastore.org/api/json/catalog.json
             "json": {
@@ -893,15 +1478,30 @@ class CodeIntelJsonClientConfig(ClientConfig):
                         "url": "http://json.schemastore.org/cryproj"
                     }
                 ],
+                # Changes to the profiles apply without restarting the server.
+                "profiles": CAPABILITY_PROFILES,
             },
         }
         self.env = {}
 
 
+_json_config = None
+
+
+def json_config():
+    """Shared configuration for listeners and commands."""
+    global _json_config
+    if _json_config is None:
+        _json_config = CodeIntelJsonClientConfig()
+    return _json_config
+
+
 class CodeIntelJsonPlugin(LanguageHandler):
     def __init__(self):
         self._server_name = "JSON Language Server"
         self._config = CodeIntelJsonClientConfig()
+        # Windows whose client is starting, in on_start order.
+        self._starting = []
 
     @property
     def name(self) -> str:
@@ -916,13 +1516,314 @@ class CodeIntelJsonPlugin(LanguageHandler):
             window.status_message(
                 "{} must be installed to run {}".format(node_command()), self._server_name)
             return False
+        touch(window)
+        self._starting.append(window)
         return True
 
     def on_initialized(self, client) -> None:
+        window = self._starting.pop(0)
+        _clients[window.id()] = client
+        # The framework pushed the configured settings on initialize.
+        _pushed_settings[window.id()] = self._config.settings
         client.on_notification("textDocument/publishDiagnostics", self.on_diagnostics)
+        # Network and disk heavy: on the background worker, never on
+        # Sublime's shared async worker; messages to the server are sent
+        # from there.
+        run_in_background(lambda: self.prefetch(window, client))
+        sublime.set_timeout_async(lambda: run_in_background(
+            lambda: self.validate_workspace(window, client)), BACKGROUND_IDLE * 1000)
 
     def on_diagnostics(self, params):
+        uri = params["uri"]
+        callback = _pending_validations.pop(uri, None)
+        if callback and callback(params["diagnostics"]):
+            return
         spinner.start("JSON-CodeIntel", spinner='monkey')
+        file_name = uri_to_filename(uri)
+        for window in sublime.windows():
+            view = window.find_open_file(file_name)
+            if view:
+                view.erase_regions(CACHED_DIAGNOSTICS_KEY)
+                if time.time() - _last_modified.get(view.id(), 0) < DIAGNOSTICS_SETTLE:
+                    break
+                urls = schema_urls_for(file_name, self._config.settings["json"]["schemas"])
+                schema_hash = schemas_hash(urls)
+                if schema_hash is not None:
+                    text = view.substr(sublime.Region(0, view.size()))
+                    diagnostics_cache().put(
+                        file_name, content_hash(text), schema_hash, params["diagnostics"])
+                    schedule_cache_save()
+                break
+
+    def prefetch(self, window, client):
+        schemas = self._config.settings["json"]["schemas"]
+        urls = set()
+        for view in window.views():
+            if view.file_name() and view_matches(view, self._config):
+                urls.update(schema_urls_for(view.file_name(), schemas))
+                sniff_view(view)
+        sniffed = _sniffed_associations.get(window.id())
+        if sniffed:
+            urls.update(url for sniffed_urls in sniffed.values() for url in sniffed_urls)
+            sublime.set_timeout_async(lambda: push_associations(window, client), 0)
+        if not urls:
+            return
+        prefetch_schemas(urls)
+        build_schema_indexes(urls)
+        settings = warm_settings(self._config.settings)
+        sublime.set_timeout_async(lambda: push_settings(window, client, settings), 0)
+
+    def validate_workspace(self, window, client):
+        """Starts a low priority pass validating every workspace file with a schema."""
+        if _clients.get(window.id()) is not client:
+            return
+        jobs = list(workspace_files(window.folders(), self._config.settings["json"]["schemas"]))
+        if not jobs:
+            return
+        prefetch_schemas(set(url for file_name, urls in jobs for url in urls))
+        settings = warm_settings(self._config.settings)
+        jobs.reverse()
+
+        def start():
+            push_settings(window, client, settings)
+            self.validate_next(window, client, jobs)
+        sublime.set_timeout_async(start, 0)
+
+    def validate_next(self, window, client, jobs):
+        if _clients.get(window.id()) is not client:
+            return
+        if not jobs:
+            diagnostics_cache().save()
+            return
+        # Never compete with interactive requests: wait for the user to be idle.
+        idle = time.time() - _last_activity.get(window.id(), 0)
+        if idle < BACKGROUND_IDLE:
+            sublime.set_timeout_async(
+                lambda: self.validate_next(window, client, jobs), BACKGROUND_IDLE * 1000)
+            return
+
+        def next_job(delay=BACKGROUND_DELAY):
+            sublime.set_timeout_async(
+                lambda: self.validate_next(window, client, jobs), int(delay * 1000))
+
+        file_name, urls = jobs.pop()
+        schema_hash = schemas_hash(urls)
+        if schema_hash is None or window.find_open_file(file_name):
+            return next_job(0)
+        try:
+            with open(file_name, 'rb') as fp:
+                text = fp.read().decode('utf-8')
+        except (IOError, UnicodeDecodeError):
+            return next_job(0)
+        text_hash = content_hash(text)
+        if diagnostics_cache().get(text_hash, schema_hash) is not None:
+            return next_job(0)
+
+        uri = filename_to_uri(file_name)
+
+        def done(diagnostics):
+            """Ends this validation; returns False if the user opened the file
+            meanwhile, making the document and its diagnostics theirs."""
+            if window.find_open_file(file_name):
+                next_job()
+                return False
+            if diagnostics is not None:
+                diagnostics_cache().put(file_name, text_hash, schema_hash, diagnostics)
+            client.send_notification(Notification.didClose({"textDocument": {"uri": uri}}))
+            next_job()
+            return True
+
+        def timeout():
+            if _pending_validations.pop(uri, None) is done:
+                done(None)
+
+        _pending_validations[uri] = done
+        client.send_notification(Notification.didOpen({
+            "textDocument": {"uri": uri, "languageId": "json", "version": 1, "text": text},
+        }))
+        sublime.set_timeout_async(timeout, BACKGROUND_TIMEOUT * 1000)
+
+
+class CodeIntelJsonFormatCommand(sublime_plugin.TextCommand):
+    """Formats the document, or the innermost object/array around the selection."""
+
+    def is_enabled(self):
+        return view_matches(self.view, json_config())
+
+    def run(self, edit, selection=False):
+        view = self.view
+        text = view.substr(sublime.Region(0, view.size()))
+        region = None
+        if selection:
+            sel = view.sel()[0]
+            region = (sel.begin(), sel.end())
+        change_count = view.change_count()
+        tab_size = view.settings().get('tab_size', 4)
+        insert_spaces = view.settings().get('translate_tabs_to_spaces', True)
+
+        def compute():
+            # Off the UI thread; only the (coalesced) edits are applied on it.
+            start = time.time()
+            edits = list(coalesce(text, format_edits(
+                text, region=region, tab_size=tab_size, insert_spaces=insert_spaces)))
+            status = "JSON formatted: {:.1f} MB/s".format(
+                len(text.encode('utf-8')) / 1e6 / max(time.time() - start, 1e-6))
+            sublime.set_timeout(lambda: view.run_command("code_intel_json_apply_edits", {
+                "edits": edits,
+                "change_count": change_count,
+                "status": status,
+            }), 0)
+
+        view.window().status_message("JSON formatting...")
+        run_in_thread(compute, "formatter")
+
+
+class CodeIntelJsonApplyEditsCommand(sublime_plugin.TextCommand):
+    """Applies `(begin, end, text)` edits computed for `change_count`, in one undo step."""
+
+    def run(self, edit, edits, change_count, status=None):
+        view = self.view
+        if view.change_count() != change_count:
+            view.window().status_message("JSON not formatted: the document changed meanwhile")
+            return
+        for begin, end, replacement in reversed(edits):
+            view.replace(edit, sublime.Region(begin, end), replacement)
+        if status:
+            view.window().status_message(status)
+
+
+class CodeIntelJsonProblemsCommand(sublime_plugin.WindowCommand):
+    """Lists the cached diagnostics of every validated workspace file."""
+
+    def run(self):
+        folders = self.window.folders()
+        lines = []
+        for file_name, diagnostics in sorted(diagnostics_cache().problems().items()):
+            if not any(file_name.startswith(folder + os.sep) for folder in folders):
+                continue
+            for diagnostic in diagnostics:
+                start = diagnostic["range"]["start"]
+                lines.append("{}:{}:{}: {}".format(
+                    file_name, start["line"] + 1, start["character"] + 1, diagnostic["message"]))
+        panel = self.window.create_output_panel("code_intel_json_problems")
+        panel.settings().set("result_file_regex", r"^(.+?):(\d+):(\d+): (.*)$")
+        panel.run_command("append", {"characters": "\n".join(lines) or "No problems found."})
+        self.window.run_command("show_panel", {"panel": "output.code_intel_json_problems"})
+
+
+class CodeIntelJsonMemoryReportCommand(sublime_plugin.WindowCommand):
+    """Writes memory reports of the plugin and of this window's server to disk.
+
+    With heap_snapshot=true the server also writes a V8 heap snapshot; with
+    stop=true plugin allocation tracing is stopped after this report.
+    """
+
+    def run(self, heap_snapshot=False, stop=False):
+        directory = os.path.join(sublime.cache_path(), 'JSON-CodeIntel', 'memory')
+        os.makedirs(directory, exist_ok=True)
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        report = plugin_report({
+            "catalog": json_config().settings,
+            "schema cache": cached_schemas(),
+            "pushed settings": _pushed_settings,
+            "sniffed associations": _sniffed_associations,
+            "diagnostics cache": vars(diagnostics_cache()),
+        }, stop=stop)
+        self.write(os.path.join(directory, 'plugin-{}.txt'.format(stamp)), report)
+
+        client = _clients.get(self.window.id())
+        if not client:
+            return
+        params = {}
+        if heap_snapshot:
+            params["heapSnapshot"] = os.path.join(directory, 'server-{}.heapsnapshot'.format(stamp))
+        client.send_request(
+            Request("json/memoryUsage", params),
+            lambda result: self.write(
+                os.path.join(directory, 'server-{}.txt'.format(stamp)), server_report(result)))
+
+    def write(self, file_name, report):
+        with open(file_name, 'w', encoding='utf-8') as fp:
+            fp.write(report)
+        panel = self.window.create_output_panel("code_intel_json_memory")
+        panel.run_command("append", {"characters": "{}\n\n{}\n".format(file_name, report)})
+        self.window.run_command("show_panel", {"panel": "output.code_intel_json_memory"})
+
+
+class CodeIntelJsonShardsCommand(sublime_plugin.WindowCommand):
+    """Shows which server instance each open document is assigned to."""
+
+    def run(self):
+        client = _clients.get(self.window.id())
+        if client:
+            client.send_request(Request("json/shards", {}), self.show)
+
+    def show(self, shards):
+        lines = []
+        for shard in shards:
+            lines.append("{}:".format(shard["name"]))
+            for instance in shard["instances"]:
+                lines.append("  {} (pid {}): {} documents".format(
+                    instance["name"], instance["pid"], len(instance["documents"])))
+                lines.extend("    {}".format(uri_to_filename(uri)) for uri in instance["documents"])
+        panel = self.window.create_output_panel("code_intel_json_shards")
+        panel.run_command("append", {"characters": "\n".join(lines)})
+        self.window.run_command("show_panel", {"panel": "output.code_intel_json_shards"})
+
+
+class CodeIntelJsonActivityListener(sublime_plugin.EventListener):
+    def on_load_async(self, view):
+        if view.file_name() and view_matches(view, json_config()):
+            # Cancel a background validation of the same file.
+            callback = _pending_validations.pop(filename_to_uri(view.file_name()), None)
+            if callback:
+                callback(None)
+            show_cached_diagnostics(view)
+            self.sniff(view)
+            urls = view_schema_urls(view)
+            run_in_thread(lambda: build_schema_indexes(urls), "schema index")
+
+    def on_query_completions(self, view, prefix, locations):
+        if view_matches(view, json_config()):
+            completions = local_completions(view, prefix, locations[0])
+            if completions is None:
+                completions = server_completions(view, locations[0])
+            return completions
+
+    def on_hover(self, view, point, hover_zone):
+        if hover_zone != sublime.HOVER_TEXT or not view_matches(view, json_config()):
+            return
+        content = local_hover(view, point)
+        if content:
+            view.show_popup(
+                content, sublime.HIDE_ON_MOUSE_MOVE_AWAY, location=point, max_width=600)
+        else:
+            server_hover(view, point)
+
+    def on_close(self, view):
+        _last_modified.pop(view.id(), None)
+        _path_caches.pop(view.id(), None)
+        _server_completions.pop(view.id(), None)
+
+    def on_post_save_async(self, view):
+        if view.file_name() and view_matches(view, json_config()):
+            self.sniff(view)
+
+    def sniff(self, view):
+        window = view.window()
+        client = _clients.get(window.id()) if window else None
+        if sniff_view(view) and client:
+            push_associations(window, client)
+
+    def on_activated_async(self, view):
+        if view_matches(view, json_config()):
+            add_completion_triggers(view)
+            touch(view.window())
+
+    def on_modified_async(self, view):
+        if view_matches(view, json_config()):
+            _last_modified[view.id()] = time.time()
+            touch(view.window())
 
 
 def plugin_loaded():
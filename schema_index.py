@@ -0,0 +1,214 @@
+"""
+Schemas precompiled into flat lookup tables for instant completion and hover.
+
+A schema is walked once, resolving local `$ref`s and merging `allOf`, into a
+table mapping JSON paths (tuples of property names, '*' for additional or
+pattern properties and '[]' for array items) to the properties, enum values,
+default and description allowed there. Nodes that cannot be answered without
+the document's content (`oneOf`, `anyOf`, `if`/`then`, external `$ref`s...)
+are marked complex and left to the server.
+"""
+import json
+from collections import deque, namedtuple
+
+from .formatting import tokens
+
+MAX_DEPTH = 10
+MAX_NODES = 20000
+
+ANY = '*'
+ITEMS = '[]'
+COMPLEX_KEYWORDS = ('oneOf', 'anyOf', 'not', 'if', 'then', 'else', 'dependencies')
+
+SchemaNode = namedtuple('SchemaNode', 'properties enum default description complex')
+
+
+class SchemaIndex(object):
+    def __init__(self, schema, max_depth=MAX_DEPTH, max_nodes=MAX_NODES):
+        self.root = schema
+        self.max_depth = max_depth
+        self.max_nodes = max_nodes
+        self.nodes = {}
+        self._compile(schema)
+
+    def _resolve(self, schema, refs=()):
+        """Follows local `$ref`s and merges `allOf`; returns (schema, complex)."""
+        complex = False
+        while isinstance(schema, dict) and isinstance(schema.get('$ref'), str):
+            ref = schema['$ref']
+            if not ref.startswith('#') or ref in refs:
+                return {}, True
+            refs = refs + (ref,)
+            target = self.root
+            for part in ref[1:].split('/'):
+                if not part:
+                    continue
+                part = part.replace('~1', '/').replace('~0', '~')
+                target = target.get(part) if isinstance(target, dict) else None
+            if not isinstance(target, dict):
+                return {}, True
+            # Sibling keywords (description...) override the referenced ones.
+            schema = dict(target, **dict((k, v) for k, v in schema.items() if k != '$ref'))
+        if not isinstance(schema, dict):
+            return {}, True
+        if 'allOf' in schema:
+            merged = dict((k, v) for k, v in schema.items() if k != 'allOf')
+            properties = dict(merged.get('properties', {}))
+            for part in schema['allOf']:
+                part, part_complex = self._resolve(part, refs)
+                complex = complex or part_complex
+                properties.update(part.get('properties', {}))
+                for key, value in part.items():
+                    merged.setdefault(key, value)
+            merged['properties'] = properties
+            schema = merged
+        complex = complex or any(keyword in schema for keyword in COMPLEX_KEYWORDS)
+        return schema, complex
+
+    def _compile(self, schema):
+        # Breadth first, so when a huge (or recursive) schema hits the limits
+        # it is the deepest paths that are left to the server.
+        queue = deque([(schema, ())])
+        while queue and len(self.nodes) < self.max_nodes:
+            schema, path = queue.popleft()
+            if path in self.nodes:
+                continue
+            schema, complex = self._resolve(schema)
+            properties = schema.get('properties', {})
+            if not isinstance(properties, dict):
+                properties, complex = {}, True
+            self.nodes[path] = SchemaNode(
+                properties=dict((name, self._description(child)) for name, child in properties.items()),
+                enum=schema.get('enum') if isinstance(schema.get('enum'), list) else None,
+                default=schema.get('default'),
+                description=schema.get('description'),
+                complex=complex)
+            if len(path) >= self.max_depth:
+                continue
+            for name, child in properties.items():
+                queue.append((child, path + (name,)))
+            additional = schema.get('additionalProperties')
+            if isinstance(additional, dict):
+                queue.append((additional, path + (ANY,)))
+            for child in (schema.get('patternProperties') or {}).values():
+                queue.append((child, path + (ANY,)))
+                break
+            items = schema.get('items')
+            if isinstance(items, dict):
+                queue.append((items, path + (ITEMS,)))
+
+    def _description(self, schema):
+        if isinstance(schema, dict) and 'description' not in schema and '$ref' in schema:
+            schema = self._resolve(schema)[0]
+        return schema.get('description', '') if isinstance(schema, dict) else ''
+
+    def lookup(self, path):
+        """Returns the SchemaNode at `path`, or None if the schema does not say."""
+        resolved = ()
+        for key in path:
+            if resolved + (key,) in self.nodes:
+                resolved += (key,)
+            elif key != ITEMS and resolved + (ANY,) in self.nodes:
+                # Additional or pattern properties.
+                resolved += (ANY,)
+            else:
+                return None
+        return self.nodes.get(resolved)
+
+
+def _scan(text, start, point, stack, last, checkpoints=None, every=0):
+    """Runs the json_path() state machine over `text[start:point]`; returns
+    `(stack, last)`. If `checkpoints` is given, a copy of the state is
+    appended to it about every `every` characters."""
+    next_checkpoint = start + every
+    for kind, begin, end in tokens(text[:point], start):
+        if end == point and kind == 'value':
+            # The word being typed.
+            break
+        last = kind
+        if kind in '{[':
+            stack.append([kind, None, False])
+        elif kind in '}]':
+            if stack:
+                stack.pop()
+        elif not stack:
+            pass
+        elif kind == ',':
+            stack[-1][1:] = [None, False]
+        elif kind == ':':
+            stack[-1][2] = True
+        elif kind == 'value' and stack[-1][0] == '{' and not stack[-1][2] and text[begin] == '"':
+            try:
+                stack[-1][1] = json.loads(text[begin:end])
+            except ValueError:
+                stack[-1][1] = text[begin + 1:end].rstrip('"')
+        if checkpoints is not None and end >= next_checkpoint and end < point:
+            checkpoints.append((end, [list(entry) for entry in stack], last))
+            next_checkpoint = end + every
+    return stack, last
+
+
+def _path(stack, last):
+    if last is None or not stack:
+        return (), False
+    path = []
+    for kind, key, after_colon in stack[:-1]:
+        path.append(ITEMS if kind == '[' else key)
+    kind, key, after_colon = stack[-1]
+    if kind == '[':
+        return tuple(path) + (ITEMS,), False
+    if after_colon:
+        return tuple(path) + (key,), False
+    return tuple(path), True
+
+
+def json_path(text, point):
+    """Returns `(path, in_key)` for the position `point` in `text`.
+
+    `path` leads to the value being edited; if `in_key` is True the cursor is
+    where a property name of the object at `path` goes instead.
+    """
+    return _path(*_scan(text, 0, point, [], None))
+
+
+class PathCache(object):
+    """json_path() for one document that keeps changing under the cursor.
+
+    The parser state is kept every CHECKPOINT_SIZE characters of the text
+    last seen; a query resumes from the last checkpoint whose prefix did not
+    change, so a keystroke re-tokenizes a few KiB instead of the whole
+    prefix. Finding that checkpoint only compares strings.
+    """
+    CHECKPOINT_SIZE = 4096
+
+    def __init__(self):
+        self.text = ''
+        self.checkpoints = [(0, [], None)]  # (offset, stack, last)
+
+    def offset(self, text, point):
+        """Index into self.checkpoints of the last one still valid for `text`."""
+        # A checkpoint holds while the text up to it, and the character
+        # after it (the token before might otherwise grow), is unchanged.
+        low, high = 0, len(self.checkpoints) - 1
+        while low < high:
+            middle = (low + high + 1) // 2
+            offset = self.checkpoints[middle][0]
+            if offset < point and offset < len(self.text) and text[:offset + 1] == self.text[:offset + 1]:
+                low = middle
+            else:
+                high = middle - 1
+        return low
+
+    def tokens(self, text, point):
+        """tokens() of `text`, starting at a token boundary close before `point`."""
+        return tokens(text, self.checkpoints[self.offset(text, point)][0])
+
+    def json_path(self, text, point):
+        index = self.offset(text, point)
+        del self.checkpoints[index + 1:]
+        start, stack, last = self.checkpoints[index]
+        stack, last = _scan(
+            text, start, point, [list(entry) for entry in stack], last,
+            self.checkpoints, self.CHECKPOINT_SIZE)
+        self.text = text[:point]
+        return _path(stack, last)
@@ -0,0 +1,673 @@
+/*
+ * Routes one LSP stdio connection to several vscode-json-languageserver.js
+ * processes ("shards"), so heavy schema families or huge documents do not
+ * stall everything else.
+ *
+ * Shards are configured with the `shards` initialization option:
+ *
+ *   [{"name": "cloudformation", "fileMatch": ["*.cf.json"], "instances": 1},
+ *    {"name": "large", "minSize": 1048576, "instances": 2}]
+ *
+ * A document goes to the first shard whose fileMatch matches its uri (same
+ * semantics as schema fileMatch) or whose minSize it reaches when opened;
+ * everything else goes to the "default" shard. Shards with several
+ * instances spread their documents round robin (capped by the number of
+ * cores). Instances are spawned on first use: the router answers
+ * `initialize` itself, so no server runs until a document is opened.
+ *
+ * The `json/shards` request returns the current document assignments.
+ *
+ * With the `trace` initialization option (a path), all traffic between the
+ * client and the router is appended to that file, one JSON object per line:
+ * {"t": seconds since start, "dir": "send" (from the client) or "recv",
+ * "msg": message}, for tools/lsp_replay.py.
+ *
+ * With the `idleTimeout` initialization option (seconds), every instance is
+ * shut down once the client has been quiet that long (or for a minute when
+ * no document is open), leaving only the router running; the next document
+ * message starts the instances again, reinitialized and with every open
+ * document. With no document open for EMPTY_EXIT_TIMEOUT, the router exits
+ * too.
+ *
+ * When an instance dies its pending requests are answered with an error and
+ * its documents are reopened on a fresh instance from the router's copy of
+ * their text (lazily, on their next message, once the shard keeps crashing).
+ * Requests broadcast to every instance (shutdown, json/memoryUsage) only wait
+ * for live instances, and for BROADCAST_TIMEOUT at most.
+ */
+"use strict";
+
+const childProcess = require("child_process");
+const fs = require("fs");
+const os = require("os");
+const path = require("path");
+
+const SERVER = path.join(__dirname, "vscode-json-languageserver.js");
+const DEFAULT_SHARD = "default";
+const BROADCAST_TIMEOUT = 5000;
+// Shards crashing this many times within CRASH_WINDOW (ms) get their
+// documents reopened on demand instead of right away.
+const CRASH_LIMIT = 3;
+const CRASH_WINDOW = 60000;
+// JSON-RPC InternalError.
+const INTERNAL_ERROR = -32603;
+const EMPTY_IDLE_TIMEOUT = 60;
+const EMPTY_EXIT_TIMEOUT = 30 * 60;
+const IDLE_CHECK_INTERVAL = 10000;
+// Client messages that do not count as activity.
+const NO_WAKE = [ "shutdown", "exit", "json/shards", "json/memoryUsage" ];
+
+// Notifications every instance needs to see.
+const BROADCAST = [
+ "initialized",
+ "workspace/didChangeConfiguration",
+ "workspace/didChangeWatchedFiles",
+ "json/schemaAssociations",
+ "json/schemaContent",
+ "json/schemaDelta"
+];
+
+function patternToRegExp(pattern) {
+ return new RegExp(pattern.replace(/[\-\\\{\}\+\?\|\^\$\.\,\[\]\(\)\#\s]/g, "\\$&").replace(/[\*]/g, ".*") + "$");
+}
+
+// The server's capabilities, as its onInitialize computes them, so the
+// client can be initialized before any instance runs. Keep in sync with
+// vscode-json-languageserver.js.
+function capabilities(params) {
+ const options = params.initializationOptions || {};
+ const profiles = options.profiles || {};
+ const localFeatures = options.localFeatures || [];
+ const textDocument = params.capabilities && params.capabilities.textDocument;
+ const completionItem = textDocument && textDocument.completion && textDocument.completion.completionItem;
+ function enabled(feature) {
+  return localFeatures.indexOf(feature) === -1 && [ "json", "jsonc" ].some(function(language) {
+   return !profiles[language] || profiles[language][feature] !== false;
+  });
+ }
+ return {
+  textDocumentSync: 1,
+  completionProvider: completionItem && completionItem.snippetSupport && enabled("completion") ? {
+   resolveProvider: true,
+   triggerCharacters: [ '"', ":" ]
+  } : undefined,
+  hoverProvider: enabled("hover"),
+  documentSymbolProvider: enabled("symbols"),
+  documentRangeFormattingProvider: false,
+  colorProvider: enabled("colors"),
+  foldingProvider: enabled("folding")
+ };
+}
+
+function MessageReader(stream, callback) {
+ let buffer = Buffer.alloc(0);
+ stream.on("data", function(data) {
+  buffer = Buffer.concat([ buffer, data ]);
+  for (;;) {
+   const headerEnd = buffer.indexOf("\r\n\r\n");
+   if (headerEnd === -1) {
+    return;
+   }
+   const match = /Content-Length: *(\d+)/i.exec(buffer.toString("ascii", 0, headerEnd));
+   const length = match ? parseInt(match[1], 10) : 0;
+   if (buffer.length < headerEnd + 4 + length) {
+    return;
+   }
+   const body = buffer.toString("utf8", headerEnd + 4, headerEnd + 4 + length);
+   buffer = buffer.slice(headerEnd + 4 + length);
+   callback(JSON.parse(body));
+  }
+ });
+}
+
+function write(stream, message) {
+ const body = Buffer.from(JSON.stringify(message), "utf8");
+ stream.write("Content-Length: " + body.length + "\r\n\r\n");
+ stream.write(body);
+}
+
+function Router() {
+ this.shards = [ {
+  name: DEFAULT_SHARD,
+  fileMatch: [],
+  size: 1,
+  next: 0,
+  instances: [],
+  crashes: []
+ } ];
+ this.maxInstances = os.cpus().length;
+ this.documents = {};  // uri -> instance
+ this.texts = {};  // uri -> TextDocumentItem with the latest text, for reopening
+ this.initializeParams = null;
+ this.registered = {};  // methods registered with the client
+ this.exiting = false;
+ this.idleTimeout = 0;
+ this.lastActivity = Date.now();
+ this.idle = false;
+ this.replay = {};  // broadcast method -> last params, for late instances
+ this.clientRequests = {};  // router id -> {instance, id} for server -> client requests
+ this.internalRequests = {};  // router id -> {instance, callback}
+ this.nextId = 0;
+ this.trace = null;
+ this.traceStart = Date.now();
+}
+
+Router.prototype.configure = function(options) {
+ const self = this;
+ if (options && options.trace) {
+  this.trace = fs.createWriteStream(options.trace, {
+   flags: "a"
+  });
+ }
+ this.idleTimeout = options && options.idleTimeout || 0;
+ if (this.idleTimeout) {
+  setInterval(function() {
+   self.checkIdle();
+  }, IDLE_CHECK_INTERVAL).unref();
+ }
+ (options && options.shards || []).forEach(function(shard) {
+  self.shards.splice(self.shards.length - 1, 0, {
+   name: shard.name,
+   fileMatch: (shard.fileMatch || []).map(patternToRegExp),
+   minSize: shard.minSize,
+   size: Math.max(1, Math.min(shard.instances || 1, self.maxInstances)),
+   next: 0,
+   instances: [],
+   crashes: []
+  });
+ });
+};
+
+Router.prototype.shardFor = function(uri, size) {
+ for (let i = 0; i < this.shards.length - 1; i++) {
+  const shard = this.shards[i];
+  if (shard.fileMatch.some(function(re) {
+    return re.test(uri);
+   }) || shard.minSize && size >= shard.minSize) {
+   return shard;
+  }
+ }
+ return this.shards[this.shards.length - 1];
+};
+
+Router.prototype.instanceFor = function(shard) {
+ const index = shard.next++ % shard.size;
+ if (!shard.instances[index]) {
+  shard.instances[index] = this.spawn(shard, index);
+ }
+ return shard.instances[index];
+};
+
+Router.prototype.spawn = function(shard, index) {
+ const self = this;
+ const name = shard.name + "#" + index;
+ const child = childProcess.spawn(process.execPath, [ SERVER, "--stdio" ], {
+  stdio: [ "pipe", "pipe", "inherit" ]
+ });
+ const instance = {
+  name: name,
+  shard: shard,
+  child: child,
+  // The one whose server to client notifications and requests go through.
+  primary: shard.name === DEFAULT_SHARD && index === 0,
+  pending: {}  // client request id (as a string) -> id
+ };
+ MessageReader(child.stdout, function(message) {
+  self.fromServer(instance, message);
+ });
+ child.stdin.on("error", function(error) {
+  // EPIPE and the like; the exit handler cleans up.
+  process.stderr.write("json router: " + name + ": " + error.message + "\n");
+ });
+ child.on("exit", function(code, signal) {
+  process.stderr.write("json router: " + name + " exited with " + (signal || code) + "\n");
+  self.remove(instance);
+ });
+ // Every instance gets the client's initialization and the latest broadcast
+ // notifications, ahead of any document (the server handles messages in
+ // order).
+ this.request(instance, "initialize", this.initializeParams, function() {});
+ BROADCAST.forEach(function(method) {
+  if (self.replay[method] !== undefined) {
+   self.send(instance, {
+    jsonrpc: "2.0",
+    method: method,
+    params: self.replay[method]
+   });
+  }
+ });
+ process.stderr.write("json router: started " + name + " (pid " + child.pid + ")\n");
+ return instance;
+};
+
+Router.prototype.remove = function(instance) {
+ const self = this;
+ const shard = instance.shard;
+ const index = shard.instances.indexOf(instance);
+ if (index !== -1) {
+  shard.instances[index] = null;
+ }
+ instance.child = null;
+ // Answer whatever it will never answer.
+ Object.keys(instance.pending).forEach(function(key) {
+  self.toClient({
+   jsonrpc: "2.0",
+   id: instance.pending[key],
+   error: {
+    code: INTERNAL_ERROR,
+    message: "JSON server instance " + instance.name + " exited"
+   }
+  });
+ });
+ instance.pending = {};
+ Object.keys(this.internalRequests).forEach(function(id) {
+  const pending = self.internalRequests[id];
+  if (pending.instance === instance) {
+   delete self.internalRequests[id];
+   pending.callback({
+    id: id,
+    result: null
+   });
+  }
+ });
+ Object.keys(this.clientRequests).forEach(function(id) {
+  if (self.clientRequests[id].instance === instance) {
+   delete self.clientRequests[id];
+  }
+ });
+ if (this.exiting || instance.stopping) {
+  return;
+ }
+ const now = Date.now();
+ shard.crashes = shard.crashes.filter(function(time) {
+  return now - time < CRASH_WINDOW;
+ }).concat(now);
+ Object.keys(this.documents).forEach(function(uri) {
+  if (self.documents[uri] === instance) {
+   delete self.documents[uri];
+   if (shard.crashes.length < CRASH_LIMIT) {
+    self.open(uri);
+   }
+  }
+ });
+};
+
+Router.prototype.checkIdle = function() {
+ const empty = !Object.keys(this.texts).length;
+ const timeout = empty ? Math.min(this.idleTimeout, EMPTY_IDLE_TIMEOUT) : this.idleTimeout;
+ const instances = this.allInstances();
+ if (empty && !instances.length && Date.now() - this.lastActivity >= EMPTY_EXIT_TIMEOUT * 1000) {
+  // The client starts a new one when it needs it again.
+  process.stderr.write("json router: no documents for " + EMPTY_EXIT_TIMEOUT + " s, exiting\n");
+  if (this.trace) {
+   this.trace.end();
+  }
+  process.exit(0);
+ }
+ if (this.idle || !instances.length || Date.now() - this.lastActivity < timeout * 1000) {
+  return;
+ }
+ process.stderr.write("json router: idle, stopping " + instances.length + " instance(s)\n");
+ this.idle = true;
+ instances.forEach(this.stop, this);
+};
+
+Router.prototype.stop = function(instance) {
+ const self = this;
+ // Detached right away: anything arriving meanwhile goes to a new instance.
+ instance.stopping = true;
+ instance.shard.instances[instance.shard.instances.indexOf(instance)] = null;
+ Object.keys(this.documents).forEach(function(uri) {
+  if (self.documents[uri] === instance) {
+   delete self.documents[uri];
+  }
+ });
+ this.request(instance, "shutdown", null, function() {
+  self.send(instance, {
+   jsonrpc: "2.0",
+   method: "exit",
+   params: null
+  });
+ });
+ setTimeout(function() {
+  if (instance.child) {
+   instance.child.kill();
+  }
+ }, BROADCAST_TIMEOUT).unref();
+};
+
+Router.prototype.wake = function() {
+ this.idle = false;
+ Object.keys(this.texts).forEach(function(uri) {
+  if (!this.documents[uri]) {
+   this.open(uri);
+  }
+ }, this);
+};
+
+Router.prototype.open = function(uri) {
+ const document = this.texts[uri];
+ const instance = this.instanceFor(this.shardFor(uri, Buffer.byteLength(document.text || "")));
+ this.documents[uri] = instance;
+ this.send(instance, {
+  jsonrpc: "2.0",
+  method: "textDocument/didOpen",
+  params: {
+   textDocument: document
+  }
+ });
+ return instance;
+};
+
+Router.prototype.send = function(instance, message) {
+ if (instance.child) {
+  write(instance.child.stdin, message);
+ }
+};
+
+Router.prototype.allInstances = function() {
+ return this.shards.reduce(function(all, shard) {
+  return all.concat(shard.instances.filter(Boolean));
+ }, []);
+};
+
+Router.prototype.primary = function() {
+ const shard = this.shards[this.shards.length - 1];
+ return shard.instances[0] || this.instanceFor(shard);
+};
+
+Router.prototype.request = function(instance, method, params, callback) {
+ const id = "router-" + this.nextId++;
+ this.internalRequests[id] = {
+  instance: instance,
+  callback: callback
+ };
+ this.send(instance, {
+  jsonrpc: "2.0",
+  id: id,
+  method: method,
+  params: params
+ });
+};
+
+Router.prototype.broadcastRequest = function(message, combine, paramsFor) {
+ const self = this;
+ const instances = this.allInstances();
+ const results = [];
+ let pending = instances.length;
+ let timer = null;
+ function done() {
+  clearTimeout(timer);
+  pending = -1;
+  self.toClient({
+   jsonrpc: "2.0",
+   id: message.id,
+   result: combine(results, instances)
+  });
+ }
+ if (!instances.length) {
+  done();
+  return;
+ }
+ // Whatever has not answered by then is left out.
+ timer = setTimeout(done, BROADCAST_TIMEOUT);
+ instances.forEach(function(instance, i) {
+  const params = paramsFor ? paramsFor(instance) : message.params;
+  this.request(instance, message.method, params, function(response) {
+   results[i] = response.result;
+   if (--pending === 0) {
+    done();
+   }
+  });
+ }, this);
+};
+
+Router.prototype.status = function() {
+ const self = this;
+ return this.shards.map(function(shard) {
+  return {
+   name: shard.name,
+   instances: shard.instances.filter(Boolean).map(function(instance) {
+    return {
+     name: instance.name,
+     pid: instance.child && instance.child.pid,
+     documents: Object.keys(self.documents).filter(function(uri) {
+      return self.documents[uri] === instance;
+     })
+    };
+   })
+  };
+ });
+};
+
+Router.prototype.fromClient = function(message) {
+ const method = message.method;
+ if (method !== "initialize") {
+  this.record("send", message);
+ }
+ if (method !== undefined && NO_WAKE.indexOf(method) === -1) {
+  this.lastActivity = Date.now();
+  if (this.idle && message.params && message.params.textDocument) {
+   this.wake();
+  }
+ }
+ if (method === undefined) {
+  // Response to a request an instance sent to the client.
+  const pending = this.clientRequests[message.id];
+  delete this.clientRequests[message.id];
+  if (pending) {
+   message.id = pending.id;
+   this.send(pending.instance, message);
+  }
+  return;
+ }
+ if (method === "initialize") {
+  this.initializeParams = message.params;
+  this.configure(message.params.initializationOptions);
+  this.record("send", message);
+  this.toClient({
+   jsonrpc: "2.0",
+   id: message.id,
+   result: {
+    capabilities: capabilities(message.params)
+   }
+  });
+  return;
+ }
+ if (method === "json/shards") {
+  this.toClient({
+   jsonrpc: "2.0",
+   id: message.id,
+   result: this.status()
+  });
+  return;
+ }
+ if (method === "shutdown") {
+  this.broadcastRequest(message, function() {
+   return null;
+  });
+  return;
+ }
+ if (method === "json/memoryUsage") {
+  this.broadcastRequest(message, function(results, instances) {
+   const combined = {
+    memoryUsage: {},
+    heapSpaces: [],
+    documents: 0,
+    shards: {}
+   };
+   results.forEach(function(result, i) {
+    if (!result) {
+     return;
+    }
+    Object.keys(result.memoryUsage).forEach(function(key) {
+     combined.memoryUsage[key] = (combined.memoryUsage[key] || 0) + result.memoryUsage[key];
+    });
+    combined.heapSpaces = combined.heapSpaces.concat(result.heapSpaces);
+    combined.documents += result.documents;
+    combined.shards[instances[i].name] = result.memoryUsage;
+    if (result.heapSnapshot) {
+     combined.shards[instances[i].name].heapSnapshot = result.heapSnapshot;
+    }
+   });
+   return combined;
+  }, function(instance) {
+   // One heap snapshot file per instance.
+   const params = Object.assign({}, message.params);
+   if (params.heapSnapshot) {
+    params.heapSnapshot = params.heapSnapshot.replace(/(\.heapsnapshot)?$/, "-" + instance.name.replace("#", "-") + "$1");
+   }
+   return params;
+  });
+  return;
+ }
+ if (method === "exit") {
+  this.exiting = true;
+  this.allInstances().forEach(function(instance) {
+   this.send(instance, message);
+  }, this);
+  if (this.trace) {
+   this.trace.end();
+  }
+  setTimeout(function() {
+   process.exit(0);
+  }, 100);
+  return;
+ }
+ if (BROADCAST.indexOf(method) !== -1) {
+  if (method === "json/schemaDelta") {
+   this.applyDelta(message.params);
+  } else {
+   this.replay[method] = message.params;
+  }
+  this.allInstances().forEach(function(instance) {
+   this.send(instance, message);
+  }, this);
+  return;
+ }
+ const textDocument = message.params && message.params.textDocument;
+ if (!textDocument) {
+  this.forward(this.primary(), message);
+  return;
+ }
+ const uri = textDocument.uri;
+ if (method === "textDocument/didOpen") {
+  this.texts[uri] = textDocument;
+  this.open(uri);
+  return;
+ }
+ if (method === "textDocument/didChange" && this.texts[uri]) {
+  // Full document sync: the last change carries the whole text.
+  const changes = message.params.contentChanges || [];
+  this.texts[uri] = Object.assign({}, this.texts[uri], {
+   version: textDocument.version,
+   text: changes.length ? changes[changes.length - 1].text : this.texts[uri].text
+  });
+ }
+ let instance = this.documents[uri];
+ if (!instance && this.texts[uri] && method !== "textDocument/didClose") {
+  // Its instance died.
+  instance = this.open(uri);
+ }
+ if (method === "textDocument/didClose") {
+  delete this.documents[uri];
+  delete this.texts[uri];
+ }
+ this.forward(instance || this.primary(), message);
+};
+
+Router.prototype.forward = function(instance, message) {
+ if (message.id !== undefined) {
+  instance.pending[String(message.id)] = message.id;
+ }
+ this.send(instance, message);
+};
+
+Router.prototype.fromServer = function(instance, message) {
+ if (message.method === undefined) {
+  const pending = this.internalRequests[message.id];
+  if (pending) {
+   delete this.internalRequests[message.id];
+   pending.callback(message);
+  } else {
+   delete instance.pending[String(message.id)];
+   this.toClient(message);
+  }
+  return;
+ }
+ if (message.id !== undefined) {
+  const registrations = message.method === "client/registerCapability" && message.params.registrations || [];
+  const known = registrations.every(function(registration) {
+   return this.registered[registration.method];
+  }, this);
+  registrations.forEach(function(registration) {
+   this.registered[registration.method] = true;
+  }, this);
+  if (registrations.length && (!instance.primary || known)) {
+   // Registrations are per connection: the primary instance's suffice, and
+   // a restarted one's are already in place.
+   this.send(instance, {
+    jsonrpc: "2.0",
+    id: message.id,
+    result: null
+   });
+   return;
+  }
+  // Server to client request: ids from different instances may clash.
+  const id = "router-" + this.nextId++;
+  this.clientRequests[id] = {
+   instance: instance,
+   id: message.id
+  };
+  message.id = id;
+ }
+ this.toClient(message);
+};
+
+Router.prototype.applyDelta = function(delta) {
+ // Folded into the configuration replayed to late instances.
+ const config = this.replay["workspace/didChangeConfiguration"] || {
+  settings: {}
+ };
+ const json = config.settings.json || {};
+ const urls = {};
+ delta.changed.forEach(function(schema) {
+  urls[schema.url] = true;
+ });
+ delta.removed.forEach(function(url) {
+  urls[url] = true;
+ });
+ const schemas = (json.schemas || []).filter(function(schema) {
+  return !urls[schema.url];
+ }).concat(delta.changed);
+ this.replay["workspace/didChangeConfiguration"] = Object.assign({}, config, {
+  settings: Object.assign({}, config.settings, {
+   json: Object.assign({}, json, {
+    schemas: schemas
+   })
+  })
+ });
+};
+
+Router.prototype.toClient = function(message) {
+ this.record("recv", message);
+ write(process.stdout, message);
+};
+
+Router.prototype.record = function(direction, message) {
+ if (this.trace) {
+  this.trace.write(JSON.stringify({
+   t: (Date.now() - this.traceStart) / 1000,
+   dir: direction,
+   msg: message
+  }) + "\n");
+ }
+};
+
+const router = new Router();
+MessageReader(process.stdin, function(message) {
+ router.fromClient(message);
+});
+process.stdin.on("end", function() {
+ process.exit(0);
+});
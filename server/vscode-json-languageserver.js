@@ -5452,6 +5452,14 @@ module.exports = function(e) {
   (function(e) {
    e.type = new r.NotificationType("json/schemaContent");
   })(v || (v = {}));
+  var q;
+  (function(e) {
+   e.type = new r.RequestType("json/memoryUsage");
+  })(q || (q = {}));
+  var G;
+  (function(e) {
+   e.type = new r.NotificationType("json/schemaDelta");
+  })(G || (G = {}));
   var g = r.createConnection();
   process.on("unhandledRejection", function(e) {
    console.error(c.formatError("Unhandled exception", e));
@@ -5479,22 +5487,39 @@ module.exports = function(e) {
    }
    b = t("textDocument", "completion", "completionItem", "snippetSupport");
    C = t("workspace", "symbol", "dynamicRegistration");
+   K = e.initializationOptions && e.initializationOptions.profiles || {};
+   F = e.initializationOptions && e.initializationOptions.localFeatures || [];
    var n = {
     textDocumentSync: y.syncKind,
-    completionProvider: b ? {
+    completionProvider: b && Q("completion") ? {
      resolveProvider: true,
      triggerCharacters: [ '"', ":" ]
     } : void 0,
-    hoverProvider: true,
-    documentSymbolProvider: true,
+    hoverProvider: Q("hover"),
+    documentSymbolProvider: Q("symbols"),
     documentRangeFormattingProvider: false,
-    colorProvider: true,
-    foldingProvider: true
+    colorProvider: Q("colors"),
+    foldingProvider: Q("folding")
    };
    return {
     capabilities: n
    };
   });
+  var K = {};
+  // Features the client answers itself, asking the server explicitly only
+  // when it cannot: not advertised, so generic clients do not ask as well.
+  var F = [];
+  function Z(e, t) {
+   var n = e && K[e.languageId];
+   return !n || n[t] !== false;
+  }
+  function Q(e) {
+   return F.indexOf(e) === -1 && [ "json", "jsonc" ].some(function(t) {
+    return Z({
+     languageId: t
+    }, e);
+   });
+  }
   var w = {
    resolveRelativePath: function(e, t) {
     return a.resolve(t, e);
@@ -5548,6 +5573,20 @@ module.exports = function(e) {
    var t = e.settings;
    i.configure(t.http && t.http.proxy, t.http && t.http.proxyStrictSSL);
    _ = t.json && t.json.schemas;
+   if (t.json && t.json.profiles && JSON.stringify(t.json.profiles) !== JSON.stringify(K)) {
+    K = t.json.profiles;
+    y.all().forEach(function(e) {
+     if (Z(e, "validate")) {
+      P(e);
+     } else {
+      A(e);
+      g.sendDiagnostics({
+       uri: e.uri,
+       diagnostics: []
+      });
+     }
+    });
+   }
    E();
    if (C) {
     var n = t && t.json && t.json.format && t.json.format.enable;
@@ -5576,6 +5615,21 @@ module.exports = function(e) {
   g.onNotification(v.type, function(e) {
    T.resetSchema(e);
   });
+  g.onNotification(G.type, function(e) {
+   // Replaces the json.schemas entries of the changed urls, drops the
+   // removed ones and keeps everything else.
+   var t = {};
+   e.changed.forEach(function(e) {
+    t[e.url] = true;
+   });
+   e.removed.forEach(function(e) {
+    t[e] = true;
+   });
+   _ = (_ || []).filter(function(e) {
+    return !t[e.url];
+   }).concat(e.changed);
+   E();
+  });
   function E() {
    var e = {
     validate: true,
@@ -5610,8 +5664,53 @@ module.exports = function(e) {
      }
     });
    }
+   var t = D(e.schemas);
+   var n = [];
+   var r = false;
+   var i = false;
+   Object.keys(I).concat(Object.keys(t)).forEach(function(e) {
+    var o = I[e];
+    var s = t[e];
+    if (!o || !s || o.signature !== s.signature) {
+     r = true;
+     n = n.concat(o ? o.fileMatch : [], s ? s.fileMatch : []);
+     if (o && !o.fileMatch.length || s && !s.fileMatch.length) {
+      i = true;
+     }
+    }
+   });
+   I = t;
+   if (!r) {
+    return;
+   }
    T.configure(e);
-   y.all().forEach(P);
+   y.all().forEach(function(e) {
+    if (i || W(e.uri, n)) {
+     P(e);
+    }
+   });
+  }
+  var I = {};
+  function D(e) {
+   var t = {};
+   e.forEach(function(e) {
+    var n = t[e.uri] || (t[e.uri] = {
+     signature: "",
+     fileMatch: []
+    });
+    n.signature += JSON.stringify([ e.fileMatch, e.schema ]);
+    n.fileMatch = n.fileMatch.concat(e.fileMatch || []);
+   });
+   return t;
+  }
+  function W(e, t) {
+   return t.some(function(t) {
+    try {
+     return new RegExp(t.replace(/[\-\\\{\}\+\?\|\^\$\.\,\[\]\(\)\#\s]/g, "\\$&").replace(/[\*]/g, ".*") + "$").test(e);
+    } catch (e) {
+     return false;
+    }
+   });
   }
   y.onDidChangeContent(function(e) {
    P(e.document);
@@ -5634,6 +5733,9 @@ module.exports = function(e) {
   }
   function P(e) {
    A(e);
+   if (!Z(e, "validate")) {
+    return;
+   }
    k[e.uri] = setTimeout(function() {
     delete k[e.uri];
     j(e);
@@ -5696,6 +5798,9 @@ module.exports = function(e) {
   g.onCompletion(function(e, t) {
    return c.runSafeAsync(function() {
     var t = y.get(e.textDocument.uri);
+    if (!Z(t, "completion")) {
+     return Promise.resolve(null);
+    }
     var n = N(t);
     return T.doComplete(t, e.position, n);
    }, null, "Error while computing completions for " + e.textDocument.uri, t);
@@ -5708,6 +5813,9 @@ module.exports = function(e) {
   g.onHover(function(e, t) {
    return c.runSafeAsync(function() {
     var t = y.get(e.textDocument.uri);
+    if (!Z(t, "hover")) {
+     return Promise.resolve(null);
+    }
     var n = N(t);
     return T.doHover(t, e.position, n);
    }, null, "Error while computing hover for " + e.textDocument.uri, t);
@@ -5715,6 +5823,9 @@ module.exports = function(e) {
   g.onDocumentSymbol(function(e, t) {
    return c.runSafe(function() {
     var t = y.get(e.textDocument.uri);
+    if (!Z(t, "symbols")) {
+     return [];
+    }
     var n = N(t);
     return T.findDocumentSymbols(t, n);
    }, [], "Error while computing document symbols for " + e.textDocument.uri, t);
@@ -5728,7 +5839,7 @@ module.exports = function(e) {
   g.onDocumentColor(function(e, t) {
    return c.runSafeAsync(function() {
     var t = y.get(e.textDocument.uri);
-    if (t) {
+    if (t && Z(t, "colors")) {
      var n = N(t);
      return T.findDocumentColors(t, n);
     }
@@ -5738,7 +5849,7 @@ module.exports = function(e) {
   g.onColorPresentation(function(e, t) {
    return c.runSafe(function() {
     var t = y.get(e.textDocument.uri);
-    if (t) {
+    if (t && Z(t, "colors")) {
      var n = N(t);
      return T.getColorPresentations(t, n, e.color, e.range);
     }
@@ -5748,12 +5859,24 @@ module.exports = function(e) {
   g.onRequest(h.FoldingRangesRequest.type, function(e, t) {
    return c.runSafe(function() {
     var n = y.get(e.textDocument.uri);
-    if (n) {
+    if (n && Z(n, "folding")) {
      return d.getFoldingRegions(n, e.maxRanges, t);
     }
     return null;
    }, null, "Error while computing folding ranges for " + e.textDocument.uri, t);
   });
+  g.onRequest(q.type, function(e) {
+   var t = require("v8");
+   var n = {
+    memoryUsage: process.memoryUsage(),
+    heapSpaces: t.getHeapSpaceStatistics(),
+    documents: y.all().length
+   };
+   if (e && e.heapSnapshot && t.writeHeapSnapshot) {
+    n.heapSnapshot = t.writeHeapSnapshot(e.heapSnapshot);
+   }
+   return n;
+  });
   g.listen();
  },
  TDAU: function(e, t, n) {
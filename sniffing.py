@@ -0,0 +1,119 @@
+"""
+Content based schema detection for documents no `fileMatch` applies to.
+
+Only the first few KB of a document are scanned, at byte level, against a
+precomputed table of fingerprints; the document is never parsed (only
+tokenized, when it may declare its own schema).
+"""
+import re
+
+from .formatting import OPEN, CLOSE, tokens
+
+SNIFF_SIZE = 4096
+
+SCHEMA_RE = re.compile(br'"\$schema"\s*:\s*"')
+
+
+def _fingerprint(url, *patterns):
+    return url, tuple(re.compile(pattern) for pattern in patterns)
+
+
+# Checked in order, the first fingerprint whose patterns all match wins, so
+# more specific ones come first.
+FINGERPRINTS = (
+    _fingerprint(
+        "http://json.schemastore.org/geojson",
+        br'"type"\s*:\s*"(?:FeatureCollection|Feature|GeometryCollection|(?:Multi)?(?:Point|LineString|Polygon))"',
+        br'"(?:features|geometry|geometries|coordinates)"\s*:'),
+    _fingerprint(
+        "http://json.schemastore.org/band-manifest",
+        br'"manifest_version"\s*:',
+        br'"tile_icon"\s*:'),
+    _fingerprint(
+        "http://json.schemastore.org/webextension",
+        br'"manifest_version"\s*:',
+        br'"(?:applications|browser_specific_settings)"\s*:\s*\{\s*"gecko"'),
+    _fingerprint(
+        "http://json.schemastore.org/chrome-manifest",
+        br'"manifest_version"\s*:',
+        br'"name"\s*:',
+        br'"version"\s*:'),
+    _fingerprint(
+        "http://json.schemastore.org/openfin",
+        br'"startup_app"\s*:\s*\{'),
+    _fingerprint(
+        "https://json-stat.org/format/schema/2.0/",
+        br'"version"\s*:\s*"2\.0"',
+        br'"class"\s*:\s*"(?:dataset|collection|dimension)"'),
+    _fingerprint(
+        "http://json.schemastore.org/sarif-1.0.0-beta.5.json",
+        br'"version"\s*:\s*"1\.0\.0-beta\.5"',
+        br'"runs"\s*:'),
+    _fingerprint(
+        "http://json.schemastore.org/sarif-1.0.0-beta.4.json",
+        br'"version"\s*:\s*"1\.0\.0-beta\.4"',
+        br'"runs"\s*:'),
+    _fingerprint(
+        "http://json.schemastore.org/sarif-1.0.0.json",
+        br'"version"\s*:\s*"1\.0\.0"',
+        br'"runs"\s*:'),
+    _fingerprint(
+        "http://json.schemastore.org/schema-catalog",
+        br'"schemas"\s*:\s*\[',
+        br'"fileMatch"\s*:'),
+    _fingerprint(
+        "http://json.schemastore.org/jdt",
+        br'"@jdt\.(?:replace|remove|rename|merge)"\s*:'),
+    _fingerprint(
+        "http://json.schemastore.org/schema-org-action",
+        br'"@context"\s*:\s*"https?://schema\.org/?"',
+        br'"@type"\s*:\s*"\w*Action"'),
+    _fingerprint(
+        "http://json.schemastore.org/schema-org-contact-point",
+        br'"@context"\s*:\s*"https?://schema\.org/?"',
+        br'"@type"\s*:\s*"ContactPoint"'),
+    _fingerprint(
+        "http://json.schemastore.org/schema-org-place",
+        br'"@context"\s*:\s*"https?://schema\.org/?"',
+        br'"@type"\s*:\s*"Place"'),
+    _fingerprint(
+        "http://json.schemastore.org/schema-org-thing",
+        br'"@context"\s*:\s*"https?://schema\.org/?"',
+        br'"@type"\s*:'),
+)
+
+
+def declares_schema(head):
+    """Whether the root object in the bytes `head` has a `$schema` key;
+    nested ones (e.g. in embedded documents) don't count."""
+    if not SCHEMA_RE.search(head):
+        return False
+    text = head.decode('utf-8', 'ignore')
+    depth = 0
+    key = None
+    for kind, begin, end in tokens(text):
+        if kind in ('line', 'block'):
+            continue
+        if kind in OPEN:
+            depth += 1
+        elif kind in CLOSE:
+            depth -= 1
+        elif kind == ':' and depth == 1 and key == '"$schema"':
+            return True
+        key = text[begin:end] if kind == 'value' else None
+    return False
+
+
+def sniff_schema(head):
+    """Returns the schema url for a document starting with the bytes `head`.
+
+    Returns None if the document declares its own top level `$schema` (the
+    server already honours it) or if no fingerprint matches.
+    """
+    head = head[:SNIFF_SIZE]
+    if declares_schema(head):
+        return None
+    for url, patterns in FINGERPRINTS:
+        if all(pattern.search(head) for pattern in patterns):
+            return url
+    return None
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""
+Replays a recorded LSP trace against the bundled JSON server.
+
+Traces are recorded by server/router.js when the `trace` initialization
+option is set in CodeIntelJsonClientConfig (see router.js for the format).
+Only the client's requests and notifications are replayed; server to client
+requests are answered live. The client side
+of the trace is replayed headlessly, `--speed` times faster than recorded,
+by `--sessions` parallel server processes. Each session gets its own
+document uris, and every http(s) schema url is rewritten to a local stand-in
+server, so no network access is needed: schemas are served from
+`--schemas DIR` (files named after the sha1 of their url, with a .json
+extension) or as an empty, permissive schema.
+
+Reports throughput, request latency percentiles and peak RSS:
+
+    python3 tools/lsp_replay.py trace.jsonl --speed 10 --sessions 8
+"""
+import os
+import json
+import time
+import hashlib
+import argparse
+import threading
+import subprocess
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'server', 'vscode-json-languageserver.js')
+# Client messages the replay sends itself.
+SKIPPED_METHODS = {'shutdown', 'exit'}
+# Messages whose http(s) strings are schema urls.
+SCHEMA_METHODS = {'workspace/didChangeConfiguration', 'json/schemaAssociations', 'json/schemaDelta'}
+
+
+def load_trace(path):
+    messages = []
+    with open(path, 'rb') as fp:
+        for line in fp:
+            record = json.loads(line.decode('utf-8'))
+            method = record['msg'].get('method')
+            # Messages without a method are the client's responses to server
+            # requests, which the replay answers itself.
+            if record['dir'] == 'send' and method and method not in SKIPPED_METHODS:
+                messages.append((record['t'], record['msg']))
+    if messages:
+        start = messages[0][0]
+        messages = [(t - start, msg) for t, msg in messages]
+    return messages
+
+
+def rewrite(obj, string):
+    """Returns a copy of `obj` with every str value passed through `string(key, value)`."""
+    if isinstance(obj, dict):
+        return dict((key, string(key, value) if isinstance(value, str) else rewrite(value, string))
+                    for key, value in obj.items())
+    if isinstance(obj, list):
+        return [string(None, value) if isinstance(value, str) else rewrite(value, string) for value in obj]
+    return obj
+
+
+def url_hash(url):
+    return hashlib.sha1(url.encode('utf-8')).hexdigest()
+
+
+def schema_server(directory):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = b'{}'
+            if directory:
+                path = os.path.join(directory, os.path.basename(self.path) + '.json')
+                if os.path.exists(path):
+                    with open(path, 'rb') as fp:
+                        body = fp.read()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def peak_rss(pid):
+    """Peak resident set size of `pid` in bytes, None if unknown."""
+    try:
+        with open('/proc/{}/status'.format(pid)) as fp:
+            for line in fp:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except IOError:
+        pass
+    try:
+        import psutil
+        return psutil.Process(pid).memory_info().rss
+    except Exception:
+        return None
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+class Connection(object):
+    """Content-Length framed JSON-RPC over a server process's stdio."""
+
+    def __init__(self, process):
+        self.process = process
+        self.lock = threading.Lock()
+
+    def start(self, on_receive, on_closed):
+        thread = threading.Thread(target=self.read, args=(on_receive, on_closed))
+        thread.daemon = True
+        thread.start()
+
+    def send(self, message):
+        body = json.dumps(message).encode('utf-8')
+        with self.lock:
+            self.process.stdin.write('Content-Length: {}\r\n\r\n'.format(len(body)).encode('ascii') + body)
+            self.process.stdin.flush()
+
+    def read(self, on_receive, on_closed):
+        stdout = self.process.stdout
+        try:
+            while True:
+                length = None
+                while True:
+                    line = stdout.readline()
+                    if not line:
+                        return
+                    if not line.strip():
+                        break
+                    if line.lower().startswith(b'content-length:'):
+                        length = int(line.split(b':', 1)[1])
+                on_receive(json.loads(stdout.read(length).decode('utf-8')))
+        finally:
+            on_closed()
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+        except (IOError, OSError, ValueError):
+            pass
+
+
+class Session(object):
+    def __init__(self, index, messages, speed, schema_base, server):
+        self.index = index
+        self.speed = speed
+        self.messages = [self.prepare(msg, schema_base) for t, msg in messages]
+        self.times = [t for t, msg in messages]
+        self.process = subprocess.Popen(
+            ['node', server, '--stdio'], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        self.transport = Connection(self.process)
+        self.pending = {}  # request id -> (method, send time)
+        self.latencies = {}  # method -> [seconds]
+        self.diagnostics = 0
+        self.edits = 0
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+        self.peak_rss = None
+        self.died = None  # exit code of a server that stopped before the end
+
+    def prepare(self, message, schema_base):
+        prefix = 'file:///session-{}/'.format(self.index)
+        if message.get('method') == 'initialize':
+            # The recording editor's pid: the server exits once it is gone.
+            # And replays must not append to the recorded trace.
+            params = dict(message['params'], processId=None)
+            options = params.get('initializationOptions')
+            if isinstance(options, dict):
+                params['initializationOptions'] = dict(
+                    (key, value) for key, value in options.items() if key != 'trace')
+            message = dict(message, params=params)
+
+        def string(key, value):
+            if key == 'uri' and value.startswith('file:///'):
+                return prefix + value[len('file:///'):]
+            if message.get('method') in SCHEMA_METHODS and value.startswith(('http://', 'https://')):
+                return schema_base + url_hash(value)
+            return value
+        return rewrite(message, string)
+
+    def on_receive(self, message):
+        now = time.time()
+        if 'method' not in message:
+            with self.lock:
+                method, sent = self.pending.pop(message.get('id'), (None, None))
+                if method:
+                    self.latencies.setdefault(method, []).append(now - sent)
+        elif 'id' in message:
+            # Server to client request (configuration, registrations...).
+            self.send({'jsonrpc': '2.0', 'id': message['id'], 'result': None})
+        elif message['method'] == 'textDocument/publishDiagnostics':
+            self.diagnostics += 1
+
+    def run(self):
+        self.transport.start(self.on_receive, self.done.set)
+        start = time.time()
+        for t, message in zip(self.times, self.messages):
+            delay = start + t / self.speed - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            if 'id' in message:
+                with self.lock:
+                    self.pending[message['id']] = (message['method'], time.time())
+            if message.get('method') == 'textDocument/didChange':
+                self.edits += 1
+            if not self.send(message):
+                break
+
+    def send(self, message):
+        """Sends `message`; returns False if the server is gone."""
+        try:
+            self.transport.send(message)
+            return True
+        except (IOError, OSError, ValueError):
+            self.server_died()
+            return False
+
+    def server_died(self):
+        if self.died is None:
+            self.died = self.process.wait()
+
+    def finish(self, timeout):
+        deadline = time.time() + timeout
+        while self.pending and not self.done.is_set() and time.time() < deadline:
+            time.sleep(0.05)
+        self.peak_rss = peak_rss(self.process.pid)
+        if self.done.is_set():
+            self.server_died()
+        if self.died is None:
+            self.send({'jsonrpc': '2.0', 'id': 'shutdown', 'method': 'shutdown', 'params': None})
+            time.sleep(0.1)
+            self.send({'jsonrpc': '2.0', 'method': 'exit', 'params': None})
+        self.transport.close()
+        try:
+            self.process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+
+def report(sessions, elapsed):
+    sent = sum(len(session.messages) for session in sessions)
+    edits = sum(session.edits for session in sessions)
+    latencies = {}
+    for session in sessions:
+        for method, values in session.latencies.items():
+            latencies.setdefault(method, []).extend(values)
+    lost = sum(len(session.pending) for session in sessions)
+    lines = [
+        "sessions:          {}".format(len(sessions)),
+        "duration:          {:.2f} s".format(elapsed),
+        "messages sent:     {} ({:.1f}/s)".format(sent, sent / elapsed),
+        "edits:             {} ({:.1f}/s)".format(edits, edits / elapsed),
+        "diagnostics:       {}".format(sum(session.diagnostics for session in sessions)),
+        "unanswered:        {}".format(lost),
+        "",
+        "{:<40} {:>7} {:>9} {:>9} {:>9} {:>9}".format("latency (ms)", "count", "p50", "p90", "p99", "max"),
+    ]
+    everything = []
+    for method, values in sorted(latencies.items()):
+        everything.extend(values)
+        lines.append("{:<40} {:>7} {:>9.1f} {:>9.1f} {:>9.1f} {:>9.1f}".format(
+            method, len(values), *[1000 * percentile(values, f) for f in (0.5, 0.9, 0.99, 1.0)]))
+    lines.append("{:<40} {:>7} {:>9.1f} {:>9.1f} {:>9.1f} {:>9.1f}".format(
+        "all", len(everything), *[1000 * percentile(everything, f) for f in (0.5, 0.9, 0.99, 1.0)]))
+    died = [session for session in sessions if session.died is not None]
+    if died:
+        lines.append("")
+        lines.append("server exited early in {} session(s): {}".format(len(died), ", ".join(
+            "#{} (code {})".format(session.index, session.died) for session in died)))
+    rss = [session.peak_rss for session in sessions if session.peak_rss]
+    if rss:
+        lines.append("")
+        lines.append("peak RSS:          {:.1f} MiB per server (max), {:.1f} MiB total".format(
+            max(rss) / 1048576.0, sum(rss) / 1048576.0))
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('trace', help="trace recorded by the plugin")
+    parser.add_argument('--speed', type=float, default=1.0, help="replay N times faster than recorded")
+    parser.add_argument('--sessions', type=int, default=1, help="parallel server processes")
+    parser.add_argument('--schemas', help="directory of stand-in schemas, named <sha1 of url>.json")
+    parser.add_argument('--server', default=SERVER, help="server script to run with node")
+    parser.add_argument('--timeout', type=float, default=30, help="seconds to wait for pending responses")
+    args = parser.parse_args()
+
+    messages = load_trace(args.trace)
+    if not messages:
+        parser.error("no client messages in {}".format(args.trace))
+    schemas = schema_server(args.schemas)
+    schema_base = 'http://127.0.0.1:{}/'.format(schemas.server_address[1])
+
+    sessions = [Session(i, messages, args.speed, schema_base, args.server) for i in range(args.sessions)]
+    start = time.time()
+    threads = [threading.Thread(target=session.run) for session in sessions]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for session in sessions:
+        session.finish(args.timeout)
+    elapsed = time.time() - start
+    schemas.shutdown()
+    print(report(sessions, elapsed))
+
+
+if __name__ == '__main__':
+    main()